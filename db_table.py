@@ -1,9 +1,48 @@
 # util functions for serialization/deserialization
-from utils import preprocess_value, postprocess_value
+from utils import preprocess_value
 
 # sqlite db communication
 import sqlite3
 
+# memoization of generated SQL
+from functools import lru_cache
+
+#
+# SELECT query builder
+# Builds a parameterized SELECT query from the shape of a db_table.select call
+# Only the shape of the query is used (names of tables and columns, the number of
+# values in each IN clause and whether a filter is negated), so the result can be cached
+# and reused for any parameter values
+#
+# \param table_name   string                                       name of the queried table
+# \param columns      tuple<string>                                columns to be fetched
+# \param join         tuple<tuple<string, string, string, string>> join conditions as (table1_name, table2_name, table1_column, table2_column)
+# \param where_shape  tuple<tuple<string, int | None, bool>>       where filters as (column, number of IN values, negated), None meaning strict equality
+#
+# \return string
+#
+# Example build_select_query("users", ("id", "name"), (), (("id", 2, False),)) -> "SELECT users.id, name FROM users WHERE id IN (?, ?)"
+#         build_select_query("users", ("id",), (), (("id", 2, True),))         -> "SELECT users.id FROM users WHERE id NOT IN (?, ?)"
+#
+@lru_cache(maxsize=256)
+def build_select_query(table_name, columns, join, where_shape):
+    # build query string
+    query = "SELECT %s.%s FROM %s" % (table_name, ", ".join(columns), table_name)
+
+    # build join query string
+    if join:
+        join_query_string = ["%s ON %s.%s = %s.%s" % (table2_name, table1_name, table1_column, table2_name, table2_column)
+                            for table1_name, table2_name, table1_column, table2_column in join]
+        query += " JOIN " + " JOIN ".join(join_query_string)
+
+    # build where query string
+    if where_shape:
+        where_query_string = [ ("%s %s (%s)" % (k, "NOT IN" if negated else "IN", ", ".join(["?"] * n))) if n is not None else
+                               ("%s %s ?" % (k, "!=" if negated else "=")) for k, n, negated in where_shape]
+        query += " WHERE " + " AND ".join(where_query_string)
+
+    return query
+
 # Very basic SQLite wrapper
 #
 # Creates table from schema
@@ -12,13 +51,46 @@ import sqlite3
 # If you need to change the schema of an already created table, reset the database
 # If you need to reset the database, just delete the database file (db_table.DB_NAME)
 #
+# All tables share a single database connection, so a transaction opened with begin
+# covers writes made through any table until commit_tx is called
+#
 class db_table:
 
 
     # SQLite database filename
     DB_NAME = "interview_test.db"
 
+    # PRAGMA statements applied once to every new connection
+    # WAL journaling with NORMAL sync avoids an fsync per write transaction,
+    # the remaining ones trade memory for fewer disk accesses and make
+    # concurrent readers wait instead of failing on a locked database
+    DB_PRAGMAS = [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-65536",
+        "PRAGMA busy_timeout=5000",
+    ]
+
+    # database connection shared by every table, opened on first use
+    shared_conn = None
+
+    #
+    # database connection getter
+    # opens the connection shared by every table and applies DB_PRAGMAS to it
+    # if it is not opened yet
+    #
+    # \return sqlite3.Connection
+    #
+    @classmethod
+    def get_conn(cls):
+        if cls.shared_conn is None:
+            cls.shared_conn = sqlite3.connect(cls.DB_NAME)
 
+            # tune the connection
+            for pragma in cls.DB_PRAGMAS:
+                cls.shared_conn.execute(pragma)
+        return cls.shared_conn
 
     #
     # model initialization
@@ -27,8 +99,10 @@ class db_table:
     #
     # \param name    string                name of the DB table
     # \param schema  dict<dict<string, string>, array<string>>  schema of DB table, with a column dict mapping column names to their DB type and a constraint array with constraints to apply to the table
+    #                An optional indexes dict maps index names to the array of columns they cover
     #
     # Example: table("users", { "columns": {"id": "integer PRIMARY KEY", "name": "text", "manager_id": "integer"}, "constraints": ["FOREIGN KEY(manager_id) REFERENCES users(id)"]})
+    #          table("users", { "columns": {"id": "integer PRIMARY KEY", "manager_id": "integer"}, "constraints": [], "indexes": {"idx_users_manager": ["manager_id"]}})
     #
     def __init__(self, name, schema):
         # error handling
@@ -41,15 +115,21 @@ class db_table:
         self.name         = name
         self.columns      = schema["columns"]
         self.constraints  = schema["constraints"]
-        self.db_conn      = sqlite3.connect(self.DB_NAME)
+        self.indexes      = schema.get("indexes", {})
+        self.db_conn      = self.get_conn()
+        self.stmt_cache   = {}
 
         # ensure the table is created
         self.create_table()
 
+        # cursor shared by every write, to avoid allocating one per statement
+        self.cursor = self.db_conn.cursor()
+
     #
     # CREATE TABLE IF NOT EXISTS wrapper
-    # Create the database table based on self.name and self.schema
+    # Create the database table and its indexes based on self.name and self.schema
     # If table already exists, nothing is done even if the schema has changed
+    # Indexes that do not exist yet are created
     # If you need to apply schema changes, please delete the database file
     #
     def create_table(self):
@@ -62,6 +142,11 @@ class db_table:
         # The reason is that sqlite does not provide substitution mechanism for columns parameters
         # In the context of this project, this is fine (no risk of user malicious input)
         self.db_conn.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (self.name, columns_query_string))
+
+        # CREATE INDEX IF NOT EXISTS idx_users_manager ON users (manager_id)
+        for index_name, index_columns in self.indexes.items():
+            self.db_conn.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (index_name, self.name, ", ".join(index_columns)))
+
         self.db_conn.commit()
 
     #
@@ -71,6 +156,7 @@ class db_table:
     # \param columns  array<string>         columns to be fetched. if empty, will query all the columns
     # \param join  array<tuple<db_table, db_table, string, string>>     tables and columns of a join query.  Each tuple represents a join condition with the following structure: (table1, table2, table1_column, table2_column). The join is made with the condition "JOIN table_2 ON table1.table1_column = table2.table2_column"
     # \param where   dict<string, string | list<string>>  where filters to be applied. The keys are column names, and the values are either A single value to filter for strict equality or list of values for an IN clause. Only AND is used to combine conditions.
+    # \param where_not   dict<string, string | list<string>>  negated where filters to be applied, with the same structure as where. A single value filters for strict inequality and a list of values for a NOT IN clause.
     #
     # \return [ { col1: val1, col2: val2, col3: val3 } ]
     #
@@ -78,44 +164,66 @@ class db_table:
     #         table.select()
     #         table.select(where={ "name": "John" })
     #         table.select(["name"], { "id": ["42", "32"]})
+    #         table.select(where={ "manager_id": ["42", "32"] }, where_not={ "id": ["42", "32"] })
     #
-    def select(self, columns = [], join = [], where = {}):
+    def select(self, columns = [], join = [], where = {}, where_not = {}):
         # by default, query all columns
         if not columns:
             columns = [ k for k in self.columns ]
 
-        # build query string
-        columns_query_string = ", ".join(columns)
-        query                = "SELECT %s.%s FROM %s" % (self.name, columns_query_string, self.name)
-
-        # build join query string
-        if join:
-            join_query_string = ["%s ON %s.%s = %s.%s" % (table2.name, table1.name, table1_column, table2.name, table2_column)
-                                for table1, table2, table1_column, table2_column in join]
-            query += " JOIN " + " JOIN ".join(join_query_string)
+        # build the query from its shape and collect the values to bind
+        filters = [(k, v, False) for k, v in where.items()] + [(k, v, True) for k, v in where_not.items()]
+        query   = build_select_query(
+            self.name,
+            tuple(columns),
+            tuple((table1.name, table2.name, table1_column, table2_column)
+                  for table1, table2, table1_column, table2_column in join),
+            tuple((k, len(v) if isinstance(v, list) else None, negated) for k, v, negated in filters)
+        )
 
-        # build where query string
-        if where:
-            where_query_string = [ ("%s IN (%s)" % (k, ", ".join([str(preprocess_value(val)) for val in v]))) if isinstance(v, list) else
-                                   ("%s = '%s'"  % (k, preprocess_value(v))) for k, v in where.items()]
-            query += " WHERE " + ' AND '.join(where_query_string)
+        params = []
+        for _, v, _ in filters:
+            if isinstance(v, list):
+                params.extend(preprocess_value(val) for val in v)
+            else:
+                params.append(preprocess_value(v))
 
-
-
-        result = []
-        # SELECT id, name FROM users [ WHERE id=42 AND name=John ]
+        # SELECT id, name FROM users [ WHERE id = ? AND name != ? ]
         #
         # Note that columns are formatted into the string without using sqlite safe substitution mechanism
         # The reason is that sqlite does not provide substitution mechanism for columns parameters
         # In the context of this project, this is fine (no risk of user malicious input)
-        for row in self.db_conn.execute(query):
-            result_row = {}
-            # convert from (val1, val2, val3) to { col1: val1, col2: val2, col3: val3 }
-            for i in range(0, len(columns)):
-                value = row[i]
-                result_row[columns[i]] = postprocess_value(value)
-            result.append(result_row)
-        return result
+        # Values are bound as parameters, which lets sqlite reuse the parsed statement
+        #
+        # convert from (val1, val2, val3) to { col1: val1, col2: val2, col3: val3 }
+        return [dict(zip(columns, row)) for row in self.db_conn.execute(query, params)]
+
+    #
+    # INSERT INTO query builder
+    # Returns the parameterized INSERT query for the given columns
+    # Queries are cached per column shape, so repeated inserts skip building the SQL string
+    # and hand sqlite the exact same statement, which it can reuse without parsing again
+    #
+    # \param columns    iterable<string>   columns to be filled
+    # \param or_ignore  bool               skip rows that would violate a UNIQUE or PRIMARY KEY constraint instead of failing
+    #
+    # \return string
+    #
+    # Example table.insert_query(["id", "name"])       -> "INSERT INTO users (id, name) VALUES (?, ?)"
+    #         table.insert_query(["name"], True)       -> "INSERT OR IGNORE INTO users (name) VALUES (?)"
+    #
+    def insert_query(self, columns, or_ignore = False):
+        key = ("insert", tuple(columns), or_ignore)
+        query = self.stmt_cache.get(key)
+        if query is None:
+            # INSERT [OR IGNORE] INTO users(id, name) values (?, ?)
+            #
+            # Note that columns are formatted into the string without using sqlite safe substitution mechanism
+            # The reason is that sqlite does not provide substitution mechanism for columns parameters
+            # In the context of this project, this is fine (no risk of user malicious input)
+            query = "INSERT %sINTO %s (%s) VALUES (%s)" % ("OR IGNORE " if or_ignore else "", self.name, ", ".join(key[1]), ", ".join(["?"] * len(key[1])))
+            self.stmt_cache[key] = query
+        return query
 
     #
     # INSERT INTO wrapper
@@ -128,25 +236,88 @@ class db_table:
     # Example table.insert({ "id": "42", "name": "John" })
     #
     def insert(self, item):
-        # build columns & values queries
+        in_tx = self.db_conn.in_transaction
+        self.cursor.execute(self.insert_query(item.keys()),
+                            tuple(preprocess_value(v) for v in item.values()))
+        if not in_tx:
+            self.db_conn.commit()
+        return self.cursor.lastrowid
 
-        columns_query = ", ".join(item.keys())
-        values_query  = ", ".join([ "'%s'" % preprocess_value(v) for v in item.values()])
+    #
+    # INSERT INTO wrapper for multiple rows
+    # insert all the given rows into database with a single statement and commit
+    #
+    # \param columns  array<string>          columns to be filled, in the order of the values of each row
+    # \param rows     iterable<tuple<any>>   rows to be inserted, each mapping positionally to columns
+    #
+    # \return number of inserted records
+    #
+    # Example table.insert_many(["id", "name"], [(42, "John"), (43, "Simon")])
+    #
+    def insert_many(self, columns, rows):
+        # the same INSERT statement is executed once per row
+        in_tx = self.db_conn.in_transaction
+        self.cursor.executemany(self.insert_query(columns),
+                                (tuple(preprocess_value(v) for v in row) for row in rows))
+        if not in_tx:
+            self.db_conn.commit()
+        return self.cursor.rowcount
 
+    #
+    # INSERT OR IGNORE INTO wrapper for multiple rows
+    # insert all the given rows into database with a single statement and commit,
+    # skipping the rows that would violate a UNIQUE or PRIMARY KEY constraint
+    #
+    # \param columns  array<string>          columns to be filled, in the order of the values of each row
+    # \param rows     iterable<tuple<any>>   rows to be inserted, each mapping positionally to columns
+    #
+    # \return number of inserted records
+    #
+    # Example table.insert_or_ignore_many(["name"], [("John",), ("Simon",)])
+    #
+    def insert_or_ignore_many(self, columns, rows):
+        # the same INSERT OR IGNORE statement is executed once per row
+        in_tx = self.db_conn.in_transaction
+        self.cursor.executemany(self.insert_query(columns, True),
+                                (tuple(preprocess_value(v) for v in row) for row in rows))
+        if not in_tx:
+            self.db_conn.commit()
+        return self.cursor.rowcount
 
+    #
+    # BEGIN wrapper
+    # open an explicit transaction so that subsequent writes are only flushed
+    # to disk once, when commit_tx is called
+    # While the transaction is open, the other wrappers do not commit their changes
+    #
+    # Example table.begin()
+    #         table.insert_no_commit({ "name": "John" })
+    #         table.commit_tx()
+    #
+    def begin(self):
+        self.db_conn.execute("BEGIN")
 
-        #print(len(item.values()))
-        #print(item["Speakers"])
-        # INSERT INTO users(id, name) values (42, John)
-        #
-        # Note that columns are formatted into the string without using sqlite safe substitution mechanism
-        # The reason is that sqlite does not provide substitution mechanism for columns parameters
-        # In the context of this project, this is fine (no risk of user malicious input)
-        cursor = self.db_conn.cursor()
-        cursor.execute("INSERT INTO %s (%s) VALUES (%s)" % (self.name, columns_query, values_query))
-        cursor.close()
+    #
+    # COMMIT wrapper
+    # commit the transaction opened by begin
+    #
+    def commit_tx(self):
         self.db_conn.commit()
-        return cursor.lastrowid
+
+    #
+    # INSERT INTO wrapper without commit
+    # insert the given item into database as part of the transaction opened by begin
+    #
+    # \param item  dict<string, string>   item to be insert in DB, mapping column to value
+    #
+    # \return id of the created record
+    #
+    # Example table.insert_no_commit({ "id": "42", "name": "John" })
+    #
+    def insert_no_commit(self, item):
+        self.cursor.execute(self.insert_query(item.keys()),
+                            tuple(preprocess_value(v) for v in item.values()))
+        return self.cursor.lastrowid
 
     #
     # UPDATE wrapper
@@ -160,26 +331,37 @@ class db_table:
     # Example table.update({ "name": "Simon" }, { "id": 42 })
     #
     def update(self, values, where):
-        # build set & where queries
-        set_query   = ", ".join(["%s = '%s'" % (k, preprocess_value(v)) for k,v in values.items()])
-        where_query = " AND ".join(["%s = '%s'" % (k, preprocess_value(v)) for k,v in where.items()])
+        key   = ("update", tuple(values.keys()), tuple(where.keys()))
+        query = self.stmt_cache.get(key)
+        if query is None:
+            # build set & where queries
+            set_query   = ", ".join(["%s = ?" % k for k in key[1]])
+            where_query = " AND ".join(["%s = ?" % k for k in key[2]])
 
-        # UPDATE users SET name = Simon WHERE id = 42
-        #
-        # Note that columns are formatted into the string without using sqlite safe substitution mechanism
-        # The reason is that sqlite does not provide substitution mechanism for columns parameters
-        # In the context of this project, this is fine (no risk of user malicious input)
-        cursor = self.db_conn.cursor()
-        cursor.execute("UPDATE %s SET %s WHERE %s" % (self.name, set_query, where_query))
-        cursor.close()
-        self.db_conn.commit()
-        return cursor.rowcount
+            # UPDATE users SET name = ? WHERE id = ?
+            #
+            # Note that columns are formatted into the string without using sqlite safe substitution mechanism
+            # The reason is that sqlite does not provide substitution mechanism for columns parameters
+            # In the context of this project, this is fine (no risk of user malicious input)
+            query = "UPDATE %s SET %s WHERE %s" % (self.name, set_query, where_query)
+            self.stmt_cache[key] = query
+
+        params = tuple(preprocess_value(v) for v in list(values.values()) + list(where.values()))
+
+        in_tx = self.db_conn.in_transaction
+        self.cursor.execute(query, params)
+        if not in_tx:
+            self.db_conn.commit()
+        return self.cursor.rowcount
 
     #
-    # Close the database connection
+    # Close the shared cursor and the database connection
+    # The connection is shared, so every other table is closed as well
     #
     def close(self):
+        self.cursor.close()
         self.db_conn.close()
+        db_table.shared_conn = None
 
 
 
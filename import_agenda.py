@@ -6,12 +6,12 @@ import sys
 # manipulation of excel data
 import pandas as pd
 
-# vectorized array operations
-import numpy as np
-
 # file path representation
 from pathlib import Path
 
+# memoization of parsed speaker strings
+from functools import lru_cache
+
 # access to sqlite wrapper
 from db_table import db_table
 
@@ -54,95 +54,105 @@ def validate_path():
         raise ValueError(IMPORT_INVALID_FILENAME_ERROR )
 
 #
-# Session data processor
-# Processes session data from the provided dataframe and inserts it into the sessions table
-# The function extracts relevant session fields, handles supersessions for "Sub" types,
-# and tracks session ids for use in future speaker insertions
+# Speaker string splitter
+# Converts a speaker string into a tuple of trimmed speaker names
+# Results are cached, since the same speaker string is often repeated across sessions
+#
+# \param speakers  string   speaker names separated by semicolons
+#
+# \return tuple<string>
+#
+# Example split_speakers("Rajeev Balasubramonian; Al Davis") -> ("Rajeev Balasubramonian", "Al Davis")
+#
+@lru_cache(maxsize=4096)
+def split_speakers(speakers):
+    return tuple(untrimmed_name.strip() for untrimmed_name in speakers.split(";"))
+
 #
-# \param excel_df        dataframe containing the session data from the Excel file
-# \param sessions_table  db_table object for the sessions table
+# Agenda data processor
+# Processes the session and speaker data from the provided dataframe in a single pass over its rows
+# Each session is inserted into the sessions table, handling supersessions for "Sub" types,
+# and its speakers are collected along with its id. Speakers are then matched by name or inserted,
+# and associated with their sessions in the sessions_speakers table
+# Sessions are inserted without committing, the caller is expected to wrap the call in a transaction
 #
-# \return np.ndarray     Array of session ids inserted into the sessions table
+# \param excel_df                dataframe containing the session data from the Excel file
+# \param sessions_table          db_table object for the sessions table
+# \param speakers_table          db_table object for the speakers table
+# \param sessions_speakers_table db_table object for the session_speakers table
 #
-def process_session_data(excel_df, sessions_table):
+def process_agenda_data(excel_df, sessions_table, speakers_table, sessions_speakers_table):
 
-    # use an np array to hold all session ids
-    session_ids = np.empty(len(excel_df), dtype=np.int64)
+    # (session id, speaker name) pairs, to be inserted into the join table
+    sessions_speakers = []
 
     # keep track of the last session, since this will serve as the supersession of
     # the next subsession
     last_session_id = None
 
+    # extract the session fields and speakers of every row at once, along with
+    # a mask of the fields that are present, so that no null check is made per cell
+    row_columns   = SESSIONS_COLUMNS + ["speakers"]
+    values_mat    = excel_df[row_columns].to_numpy(dtype=object).tolist()
+    present_mat   = excel_df[row_columns].notna().to_numpy().tolist()
+    session_types = excel_df["session_type"].to_numpy(dtype=object).tolist()
+
     # insert each session to the sessions table,
     # making sure to update its supersession_id if its a subsession and
     # to update the last_session_id otherwise
-    for index, row in enumerate(excel_df.to_dict("records")):
-        session_data = {key: row[key] for key in SESSIONS_COLUMNS if pd.notna(row[key])}
-
-        if row["session_type"] == "Sub":
+    for values, present, session_type in zip(values_mat, present_mat, session_types):
+        session_data = {
+            key: value
+            for key, value, is_present
+            in zip(SESSIONS_COLUMNS, values, present)
+            if is_present
+        }
+
+        if session_type == "Sub":
             session_data["supersession_id"] = last_session_id
 
-        session_ids[index] = sessions_table.insert(session_data)
+        session_id = sessions_table.insert_no_commit(session_data)
 
-        if row["session_type"] == "Session":
-            last_session_id = session_ids[index]
+        if session_type == "Session":
+            last_session_id = session_id
 
-    return session_ids
+        # convert speaker string into a list of names attending the session
+        if present[-1]:
+            sessions_speakers.extend(
+                (session_id, name)
+                for name
+                in split_speakers(str(values[-1]))
+            )
 
-#
-# Speaker data processor
-# Processes speaker data from the provided Excel DataFrame and inserts it into the speakers table
-# It matches existing speakers by name or inserts new ones, and associates them with sessions in the sessions_speakers table
-#
-# \param excel_df                dataframe containing the session data from the Excel file
-# \param session_ids             np array of session ids, used to establish relationships betwee speakers and sessions
-# \param speakers_table          db_table object for the speakers table
-# \param sessions_speakers_table db_table object for the session_speakers table
-#
-def process_speaker_data(excel_df, session_ids, speakers_table, sessions_speakers_table):
+    # every speaker name in the agenda, in order of first appearance
+    all_names = list(dict.fromkeys(name for _, name in sessions_speakers))
 
-    sessions_speakers = []
+    # add every speaker in a single statement, relying on the UNIQUE constraint
+    # of the speakers name to skip the ones that already exist, then fetch
+    # the ids of all speakers in a single query
     speaker_ids = {}
-
-    # use tuples to iterate through the speakers for performance
-    for index, speakers in excel_df.loc[:, ["speakers"]].itertuples():
-        if pd.isna(speakers):
-            continue
-
-        # convert speaker string into a list of names
-        speaker_names = [
-            untrimmed_name.strip()
-            for untrimmed_name
-            in str(speakers).split(";")
-        ]
-
-        # collect the ids for each speaker, and only add the speaker to
-        # the speakers table if it does not yet exist in the table
-        for name in speaker_names:
-            sessions_speakers.append((session_ids[index], name))
-            speaker_data = {"name":name}
-
-            speakers_match = speakers_table.select(
-                columns=["id"],
-                where=speaker_data
+    if all_names:
+        speakers_table.insert_or_ignore_many(["name"], ((name,) for name in all_names))
+        speaker_ids = {
+            speaker["name"]: speaker["id"]
+            for speaker
+            in speakers_table.select(
+                columns=["id", "name"],
+                where={"name": all_names}
             )
-
-            if speakers_match:
-                speaker_ids[name] = speakers_match[0]["id"]
-            else:
-                speaker_ids[name] = speakers_table.insert(speaker_data)
+        }
 
     # use the memoized ids to make insertions into the join table
-    for session_id, name in sessions_speakers:
-        sessions_speakers_table.insert({
-            'session_id': session_id,
-            'speaker_id': speaker_ids[name]
-        })
+    # in a single statement
+    sessions_speakers_table.insert_many(
+        ["session_id", "speaker_id"],
+        ((session_id, speaker_ids[name]) for session_id, name in sessions_speakers)
+    )
 
 #
 # Driver Program
 # Validates the input path, reads the Excel data into a dataframe,
-# and calls functions to processes the session and speaker data
+# and calls a function to processes the session and speaker data
 # Any exceptions raised during are caught and logged to the standard output
 #
 def main():
@@ -151,11 +161,15 @@ def main():
 
         filename = sys.argv[1]
 
-        # use pandas to read excel data
+        # use pandas to read excel data, only parsing the agenda columns
+        # and reading every cell as a string to skip type inference
         excel_df = pd.read_excel(
             filename,
+            engine="xlrd",
             skiprows=ROWS_TO_SKIP,
             names=EXCEL_COLUMNS,
+            usecols=range(len(EXCEL_COLUMNS)),
+            dtype=str,
         )
 
         # create tables based on the existing schemas
@@ -163,11 +177,11 @@ def main():
         speakers_table = db_table("speakers", speakers_schema)
         sessions_speakers_table = db_table("sessions_speakers", sessions_speakers_schema)
 
-        # process and insert all session data
-        session_ids = process_session_data(excel_df, sessions_table)
-
-        # use session ids to process and insert speaker data.
-        process_speaker_data(excel_df, session_ids, speakers_table, sessions_speakers_table)
+        # process and insert all session and speaker data in a single transaction
+        # the tables share their connection, so the transaction covers all of them
+        sessions_table.begin()
+        process_agenda_data(excel_df, sessions_table, speakers_table, sessions_speakers_table)
+        sessions_table.commit_tx()
 
     except Exception as e:
         print(f"Error occured: {e}")
@@ -6,6 +6,9 @@ import sys
 # access to sqlite wrapper
 from db_table import db_table
 
+# util functions for serialization/deserialization
+from utils import preprocess_value
+
 # access to relevant constants
 from constants import (
     LOOKUP_NOT_ENOUGH_ARGS_ERROR,
@@ -43,6 +46,8 @@ def validate_query():
 # Retrieves all sessions that match the given query. If the query is for a speaker name,
 # it will return all sessions the speaker attended, including all subsessions.
 # It performs a database join between sessions, session_speakers, and speakers tables.
+# Matches and their subsessions are fetched in a single recursive query, which walks down
+# from the matched sessions through the supersession_id column.
 #
 # \param column             Column being queried
 # \param value              Value to search for in the specified column
@@ -53,64 +58,80 @@ def validate_query():
 # \return list of dicts    Each dict represents a session matching the query or a subsession of a matching session.
 #
 def get_all_matches(column, value, sessions_table, sessions_speakers_table, speakers_table):
-    sessions_match = []
+    sessions = sessions_table.name
+    columns = [ k for k in sessions_table.columns ]
+    columns_query_string = ", ".join(columns)
+    sessions_columns_query_string = ", ".join(["%s.%s" % (sessions, k) for k in columns])
 
     # if a speaker is queried, use the join table to find all sessions that match
     # the provided speaker
     if (column == "speaker"):
-        sessions_match = sessions_table.select(
-            join=[
-                (sessions_table, sessions_speakers_table, "id", "session_id"),
-                (sessions_speakers_table, speakers_table, "speaker_id", "id")
-            ],
-            where={"name":value}
+        join_query_string = "JOIN %s ON %s.id = %s.session_id JOIN %s ON %s.speaker_id = %s.id" % (
+            sessions_speakers_table.name, sessions, sessions_speakers_table.name,
+            speakers_table.name, sessions_speakers_table.name, speakers_table.name
         )
-    # if the query if for a non-speaker column, simply select it from the database.
+        where_query_string = "%s.name = ?" % speakers_table.name
+    # if the query if for a non-speaker column, simply match it against the sessions table.
     else:
-        sessions_match = sessions_table.select(where={column:value})
+        join_query_string = ""
+        where_query_string = "%s.%s = ?" % (sessions, column)
+
+    # select the matching sessions, then recursively add every session whose
+    # supersession has already been selected. UNION discards sessions that
+    # were selected twice
+    #
+    # Note that columns are formatted into the string without using sqlite safe substitution mechanism
+    # The column has been validated against QUERY_COLUMNS, so there is no risk of malicious input
+    query = (
+        "WITH RECURSIVE matches (%s) AS ("
+        "SELECT %s FROM %s %s WHERE %s "
+        "UNION "
+        "SELECT %s FROM %s JOIN matches ON %s.supersession_id = matches.id"
+        ") SELECT %s FROM matches"
+    ) % (
+        columns_query_string,
+        sessions_columns_query_string, sessions, join_query_string, where_query_string,
+        sessions_columns_query_string, sessions, sessions,
+        columns_query_string
+    )
+
+    # convert from (val1, val2, val3) to { col1: val1, col2: val2, col3: val3 }
+    sessions_match = [
+        dict(zip(columns, row))
+        for row
+        in sessions_table.db_conn.execute(query, (preprocess_value(value),))
+    ]
 
     if not sessions_match:
         raise ValueError("No matches found for the given query.")
 
-    # keep track of all previous ids to get corresponding subsessions
-    selected_session_ids = [session["id"] for session in sessions_match]
-
-    # use the IN functionality of db_table to select all sessions
-    # that have not yet been selected and that have supersessions that
-    # matched the query.
-    sessions_match.extend(sessions_table.select(
-        where={
-            "supersession_id":selected_session_ids,
-            "id NOT":selected_session_ids
-        }
-    ))
-
     return sessions_match
 
 #
 # Speaker name collector
-# Returns the names of every speaker attending a given session. Joins the speaker
-# and sessions_speaker tables to directly query the speakers associated with a session id.
-# Will return an empty array if no speaker is attending the session.
-#
-# \param session              session for which we are returning the speakers
-# \param speakers_table       db_table object for the speakers table
-# \param session_speakers_table       db_table object for the session_speakers table
-#
-# \return list of speaker name strings.
-#
-def get_speaker_names(session, speakers_table, sessions_speakers_table):
-
-    # use an inner join to get all names corresponding to the session id
-    speaker_names = [
-        speaker["name"]
-        for speaker
-        in speakers_table.select(
-            columns=["name"],
-            join=[(speakers_table, sessions_speakers_table, "id", "speaker_id")],
-            where={"session_id":session["id"]}
-        )
-    ]
+# Returns the names of every speaker attending each of the given sessions. Joins the speaker
+# and sessions_speaker tables to query the speakers of all sessions at once, and groups
+# the names by session id.
+# Sessions without any speaker are not present in the returned dict.
+#
+# \param sessions                 list of sessions for which we are returning the speakers
+# \param speakers_table           db_table object for the speakers table
+# \param sessions_speakers_table  db_table object for the session_speakers table
+#
+# \return dict<int, list<string>>  mapping of session ids to speaker names
+#
+def get_speaker_names(sessions, speakers_table, sessions_speakers_table):
+
+    speaker_names = {}
+
+    # use a single inner join to get all names corresponding to the session ids
+    for speaker in speakers_table.select(
+        columns=["name", "session_id"],
+        join=[(speakers_table, sessions_speakers_table, "id", "speaker_id")],
+        where={"session_id":[session["id"] for session in sessions]}
+    ):
+        speaker_names.setdefault(speaker["session_id"], []).append(speaker["name"])
+
     return speaker_names
 
 #
@@ -154,10 +175,10 @@ def main():
         # retrieve all sessions that match the query
         all_matched_sessions = get_all_matches(column, value, sessions_table, sessions_speakers_table, speakers_table)
 
-        # retreive all speakers attending each session, and print each session
+        # retreive all speakers attending the sessions, and print each session
+        speaker_names = get_speaker_names(all_matched_sessions, speakers_table, sessions_speakers_table)
         for session in all_matched_sessions:
-            speaker_names = get_speaker_names(session, speakers_table, sessions_speakers_table)
-            print_session(session, speaker_names)
+            print_session(session, speaker_names.get(session["id"], []))
 
     except Exception as e:
         print(f"Error occured: {e}")
@@ -1,13 +1,15 @@
 # Schema Definitons
 #
 # Defines the database schema for each table in the database.
-# They include columns, data types, and any constraints like primary keys and foreign keys.
+# They include columns, data types, any constraints like primary keys and foreign keys,
+# and the indexes used to speed up lookups.
 #
 
 #
 # Sessions schema
 # This schema defines the structure of the 'sessions' table, including column data types
 # and constraints such as the foreign key linking to a subsession's supersessions.
+# Subsessions are looked up by their supersession, so supersession_id is indexed.
 #
 sessions_schema = {
     "columns":{
@@ -22,14 +24,18 @@ sessions_schema = {
     },
     "constraints": [
         "FOREIGN KEY (supersession_id) REFERENCES sessions(id)"
-    ]
+    ],
+    "indexes": {
+        "idx_sessions_super": ["supersession_id"]
+    }
 }
 
 #
 # Sessions speakers schema
 # This schema defines the structure of the 'sessions_speakers' table, a join
 # table that is used to represent the many-to-many relationships between sessions
-# and speakers
+# and speakers. The primary key already covers lookups by session_id, lookups by
+# speaker_id use a separate index.
 #
 sessions_speakers_schema = {
     "columns":{
@@ -40,7 +46,10 @@ sessions_speakers_schema = {
         "PRIMARY KEY (session_id, speaker_id)",
         "FOREIGN KEY (session_id) REFERENCES sessions(id)",
         "FOREIGN KEY (speaker_id) REFERENCES speakers(id)"
-    ]
+    ],
+    "indexes": {
+        "idx_ss_speaker": ["speaker_id"]
+    }
 }
 
 #